@@ -1,39 +1,194 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
-''' Runs checks for mesos style. '''
+'''
+Runs checks for mesos style.
 
+Most of the time is spent in cpplint, which is pure Python. To speed
+it up, the checker can be run under PyPy (e.g., `pypy3
+support/mesos-style.py`, or by setting `MESOS_STYLE_PYTHON=pypy3` for
+the git hooks), or cpplint can be compiled with Cython
+(`cythonize -i support/cpplint.py`); the compiled module is then
+picked up by `import cpplint` in place of `cpplint.py`.
+'''
+
+import multiprocessing
 import os
 import re
-import subprocess
 import sys
 
+from io import StringIO
+
 # Root source paths (will be traversed recursively).
 source_dirs = ['src',
                'include',
                os.path.join('3rdparty', 'libprocess')]
 
+# Add directory names which should not be checked; these directories
+# are not traversed at all. This should include 3rdparty libraries.
+exclude_dirs = ('protobuf-2.4.1',
+                'gmock-1.6.0',
+                'glog-0.3.3',
+                'boost-1.53.0',
+                'libev-4.15')
+
 # Add file paths and patterns which should not be checked
 # This should include 3rdparty libraries, includes and machine generated
-# source.
-exclude_files = '(protobuf\-2\.4\.1|gmock\-1\.6\.0|glog\-0\.3\.3|boost\-1\.53\.0|libev\-4\.15|java/jni|\.pb\.cc|\.pb\.h|\.md)'
+# source. A file is excluded if its path contains any of these.
+exclude_files = exclude_dirs + ('java/jni', '.pb.cc', '.pb.h', '.md')
+
+source_extensions = ('.cpp', '.hpp', '.cc', '.h')
+
+# Summary lines emitted by cpplint which are filtered from the output.
+linter_summary_regex = re.compile('^(Done processing |Total errors found: )')
+
+# Line emitted by cpplint for files it can not read. These files are
+# neither linted nor license checked, so they count as errors.
+linter_skipped_regex = re.compile('^Skipping input ')
 
-source_files = '\.(cpp|hpp|cc|h)$'
+# TODO(bbannier) We allow `Copyright` for currently deviating files.
+# This should be removed one we have a uniform license format.
+license_header_regex = re.compile(r'^// (Licensed|Copyright)')
+
+def is_excluded(path, excludes):
+    '''
+    Returns whether the path contains any of the given excludes. These
+    are plain substrings, which is cheaper to test than a regex.
+    '''
+    return any(exclude in path for exclude in excludes)
 
 def find_candidates(root_dir):
-    exclude_file_regex = re.compile(exclude_files)
-    source_criteria_regex = re.compile(source_files)
-    for root, dirs, files in os.walk(root_dir):
-        for name in files:
-            path = os.path.join(root, name)
-            if exclude_file_regex.search(path) is not None:
-                continue
+    # Traverse the tree with `os.scandir` directly, whose entries cache
+    # the file type so that no extra `stat` call is needed per entry.
+    # Like `os.walk`, unreadable directories are skipped and symbolic
+    # links to directories are not followed.
+    directories = [root_dir]
+    while directories:
+        try:
+            entries = os.scandir(directories.pop())
+        except OSError:
+            continue
 
-            if source_criteria_regex.search(name) is not None:
-                yield path
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Excluded directories are not descended into.
+                    if not entry.is_symlink() and \
+                            not is_excluded(entry.name, exclude_dirs):
+                        directories.append(entry.path)
+                elif entry.name.endswith(source_extensions) and \
+                        not is_excluded(entry.path, exclude_files):
+                    yield entry.path
+
+def normalize_path(path, cwd):
+    '''
+    Returns the given path relative to `cwd`, the current working
+    directory, in the same form as the paths from `find_candidates`.
+    '''
+    if not os.path.isabs(path):
+        return os.path.normpath(path)
+
+    try:
+        return os.path.relpath(path, cwd)
+    except ValueError:
+        # On Windows, a path on a different drive than `cwd` can not be
+        # made relative; it can not be a candidate either.
+        return path
+
+def split_into_chunks(source_paths):
+    '''
+    Splits the given paths into chunks to be processed in parallel.
+    Several chunks per worker keep the pool busy when some files take
+    much longer than others.
+    '''
+    source_paths = list(source_paths)
+    chunk_size = max(1, len(source_paths) // (4 * multiprocessing.cpu_count()))
+    return [source_paths[i:i + chunk_size]
+            for i in range(0, len(source_paths), chunk_size)]
+
+def map_in_parallel(function, chunks):
+    ''' Applies the function to each chunk using a pool of processes. '''
+    # A single chunk (e.g., the few files passed by the git hooks) is
+    # processed directly rather than forking worker processes for it.
+    if len(chunks) <= 1:
+        return [function(chunk) for chunk in chunks]
+
+    pool = multiprocessing.Pool(min(multiprocessing.cpu_count(), len(chunks)))
+    try:
+        return pool.map(function, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+def check_license_header(filename, lines, error):
+    '''
+    Checks the license header of a file. This is run by cpplint in place
+    of its own copyright check, so that each file is only read once for
+    both the license check and the lint rules.
+    '''
+    import cpplint
+
+    # Line 0 is a marker inserted by cpplint, the file starts at line 1.
+    head = lines[1]
+
+    # Check that opening comment has correct style.
+    if not license_header_regex.match(head):
+        sys.stderr.write(
+            "{path}:1:  A license header should appear on the file's "
+            " first line starting with '// Licensed'.: {head}\n".\
+                format(path=filename, head=head))
+        cpplint._cpplint_state.IncrementErrorCount('legal/license')
+
+def lint_and_capture_stderr(arguments):
+    '''
+    Runs cpplint and the license header check in-process over the
+    given arguments (rules filter followed by file paths), capturing
+    everything written.
+
+    Returns a tuple of the number of errors found and the captured
+    stderr lines, without cpplint's summary lines. Files cpplint could
+    not read are counted as errors.
+    '''
+    # Imported here so that each worker process gets its own copy of
+    # cpplint's module level state.
+    import cpplint
+
+    original_stdout = sys.stdout
+    original_stderr = sys.stderr
+    linter_stderr = StringIO()
+    sys.stdout = StringIO()
+    sys.stderr = linter_stderr
+    try:
+        # cpplint's own 'legal/copyright' check is not among the active
+        # rules; run the license header check in its place on the lines
+        # cpplint has already read.
+        cpplint.CheckForCopyright = check_license_header
+
+        filenames = cpplint.ParseArguments(arguments)
+        cpplint.LintFiles(filenames)
+        errors_found = cpplint._cpplint_state.error_count
+    finally:
+        sys.stdout = original_stdout
+        sys.stderr = original_stderr
+
+    # Lines are filtered while streaming over the captured output,
+    # only keeping found errors instead of e.g., 'Done processing XXX.'
+    # which tends to be dominant output.
+    linter_stderr.seek(0)
+    error_lines = []
+    for line in linter_stderr:
+        if linter_summary_regex.match(line):
+            continue
+
+        if linter_skipped_regex.match(line):
+            errors_found += 1
+
+        error_lines.append(line)
+
+    return errors_found, error_lines
 
 def run_lint(source_paths):
     '''
-    Runs cpplint over given files.
+    Runs cpplint and the license header check over given files.
 
     http://google-styleguide.googlecode.com/svn/trunk/cpplint/cpplint.py
     '''
@@ -59,39 +214,18 @@ def run_lint(source_paths):
         'whitespace/todo']
 
     rules_filter = '--filter=-,+' + ',+'.join(active_rules)
-    p = subprocess.Popen(
-        ['python', 'support/cpplint.py', rules_filter] + source_paths,
-        stderr=subprocess.PIPE,
-        close_fds=True)
-
-    # Lines are stored and filtered, only showing found errors instead
-    # of e.g., 'Done processing XXX.' which tends to be dominant output.
-    for line in p.stderr:
-        if re.match('^(Done processing |Total errors found: )', line):
-            continue
-        sys.stderr.write(line)
 
-    p.wait()
-    return p.returncode
+    # cpplint has no cross-file state, so lint the chunks in parallel.
+    results = map_in_parallel(
+        lint_and_capture_stderr,
+        [[rules_filter] + chunk for chunk in split_into_chunks(source_paths)])
 
-def check_license_header(source_paths):
-    ''' Checks the license headers of the given files. '''
-    error_count = 0
-    for path in source_paths:
-        with open(path) as source_file:
-            head = source_file.readline()
+    errors_found = 0
+    for chunk_errors, error_lines in results:
+        errors_found += chunk_errors
+        sys.stderr.writelines(error_lines)
 
-            # Check that opening comment has correct style.
-            # TODO(bbannier) We allow `Copyright` for currently deviating files.
-            # This should be removed one we have a uniform license format.
-            if not re.match(r'^\/\/ [Licensed|Copyright]', head):
-                sys.stderr.write(
-                    "{path}:1:  A license header should appear on the file's "
-                    " first line starting with '// Licensed'.: {head}".\
-                        format(path=path, head=head))
-                error_count += 1
-
-    return error_count
+    return errors_found
 
 
 if __name__ == '__main__':
@@ -100,36 +234,39 @@ if __name__ == '__main__':
     # (possibly nested) paths.
     for source_dir in source_dirs:
         if not os.path.exists(source_dir):
-            print "Could not find '{dir}'".format(dir=source_dir)
-            print 'Please run from the root of the mesos source directory'
+            print("Could not find '{dir}'".format(dir=source_dir))
+            print('Please run from the root of the mesos source directory')
             exit(1)
 
-    # Add all source file candidates to candidates list.
-    candidates = []
-    for source_dir in source_dirs:
-        for candidate in find_candidates(source_dir):
-            candidates.append(candidate)
+    # Add all source file candidates to candidates set.
+    candidates = {candidate
+                  for source_dir in source_dirs
+                  for candidate in find_candidates(source_dir)}
 
     # If file paths are specified, check all file paths that are
-    # candidates; else check all candidates.
-    file_paths = sys.argv[1:] if len(sys.argv) > 1 else candidates
-
-    # Compute the set intersect of the input file paths and candidates.
-    # This represents the reduced set of candidates to run lint on.
-    candidates_set = set(candidates)
-    clean_file_paths_set = set(map(lambda x: x.rstrip(), file_paths))
-    filtered_candidates_set = clean_file_paths_set.intersection(
-        candidates_set)
+    # candidates; else check all candidates. The set intersect of the
+    # input file paths and candidates represents the reduced set of
+    # candidates to run lint on.
+    if len(sys.argv) > 1:
+        # Candidates are paths relative to the current working directory,
+        # so bring the input file paths into the same form.
+        cwd = os.getcwd()
+        filtered_candidates_set = candidates.intersection(
+            normalize_path(file_path.rstrip(), cwd)
+            for file_path in sys.argv[1:])
+    else:
+        filtered_candidates_set = candidates
 
     if filtered_candidates_set:
-        print 'Checking {num_files} files'.\
-                format(num_files=len(filtered_candidates_set))
-        license_errors = check_license_header(filtered_candidates_set)
-        lint_errors = run_lint(list(filtered_candidates_set))
-        total_errors = license_errors + lint_errors
+        print('Checking {num_files} files'.
+              format(num_files=len(filtered_candidates_set)))
+        total_errors = run_lint(list(filtered_candidates_set))
         sys.stderr.write('Total errors found: {num_errors}\n'.\
                             format(num_errors=total_errors))
-        sys.exit(total_errors)
+
+        # NOTE: The exit status is taken modulo 256, so the error count
+        # itself can not be used as the exit status.
+        sys.exit(1 if total_errors else 0)
     else:
-        print "No files to lint\n"
+        print("No files to lint\n")
         sys.exit(0)
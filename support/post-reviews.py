@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # This is a wrapper around the 'post-review'/'rbt' tool provided by
 # Review Board. This is currently used by Apache Mesos development.
 #
@@ -14,6 +14,9 @@
 # First install 'RBTools' from Review Board.
 # http://www.reviewboard.org/downloads/rbtools/
 #
+# Optionally install 'pygit2' (libgit2 bindings), which is then used to
+# query the repository without spawning a git process for each query.
+#
 # $ cd /path/to/mesos
 # $ [ do some work on your branch off of master, make commit(s) ]
 # $ ./support/post-reviews.py --server=https://reviews.apache.org \
@@ -24,15 +27,20 @@
 
 import argparse
 import atexit
-import imp
 import os
 import re
+import runpy
 import sys
 
-from distutils.version import LooseVersion
-
 from subprocess import check_output, Popen, PIPE, STDOUT
 
+# If available, libgit2 is used for simple queries of the repository
+# rather than spawning a git process for each of them.
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 def execute(command, ignore_errors=False):
     process = None
     try:
@@ -40,8 +48,9 @@ def execute(command, ignore_errors=False):
                 stdin=PIPE,
                 stdout=PIPE,
                 stderr=STDOUT,
-                shell=False)
-    except:
+                shell=False,
+                universal_newlines=True)
+    except Exception:
         if not ignore_errors:
             raise
         return None
@@ -53,18 +62,113 @@ def execute(command, ignore_errors=False):
         need_login = \
           'Please log in to the Review Board server at reviews.apache.org.'
         if need_login in data:
-          print need_login, '\n'
-          print "You can either:"
-          print "  (1) Run 'rbt login', or"
-          print "  (2) Set the default USERNAME/PASSWORD in '.reviewboardrc'"
+          print(need_login, '\n')
+          print("You can either:")
+          print("  (1) Run 'rbt login', or")
+          print("  (2) Set the default USERNAME/PASSWORD in '.reviewboardrc'")
         else:
-          print 'Failed to execute: \'' + cmdline + '\':'
-          print data
+          print('Failed to execute: \'' + cmdline + '\':')
+          print(data)
         sys.exit(1)
     elif status != 0:
         return None
     return data
 
+def parse_version(version):
+    """Parses the numeric components of a version string.
+
+    For example, 'RBTools 0.6.1' is parsed into `(0, 6, 1)`, which can be
+    compared against other version tuples.
+    """
+    return tuple(int(component) for component in re.findall(r'\d+', version))
+
+def read_commits(revision_range):
+    """Reads the commits in the given revision range, oldest first.
+
+    Everything needed about each commit is read with a single call to git,
+    rather than with a call per commit for its message and for how it is
+    shown when creating or updating its review.
+
+    Returns:
+        A list of `(sha, creating_review_output, updating_review_output,
+        message)` tuples.
+    """
+    # Fields are separated by the ASCII unit separator, commits by NUL.
+    log_format = '%x1f'.join(
+        ['%H', creating_review_format, updating_review_format, '%s%n%n%b'])
+
+    log = execute(['git',
+                   '--no-pager',
+                   'log',
+                   '-z',
+                   '--pretty=format:' + log_format,
+                   '--reverse',
+                   revision_range])
+
+    if not log:
+        return []
+
+    return [tuple(commit.split('\x1f')) for commit in log.split('\0')]
+
+def open_repository():
+    """Opens the repository containing the current directory with pygit2.
+
+    Returns:
+        A `pygit2.Repository`, or `None` if pygit2 is not available or the
+        repository could not be opened.
+    """
+    if pygit2 is None:
+        return None
+
+    try:
+        path = pygit2.discover_repository(os.getcwd())
+        return pygit2.Repository(path) if path else None
+    except (pygit2.GitError, KeyError, ValueError):
+        return None
+
+def get_top_level_dir():
+    """Returns the top-level directory of the working tree."""
+    if repository is not None and repository.workdir:
+        return os.path.normpath(repository.workdir)
+
+    return execute(['git', 'rev-parse', '--show-toplevel']).strip()
+
+def get_head_ref():
+    """Returns the full name of the branch checked out, e.g. 'refs/heads/x'."""
+    if repository is not None and not repository.head_is_detached:
+        try:
+            return repository.head.name
+        except pygit2.GitError:
+            pass
+
+    # Leave it to git to report errors, e.g. for a detached HEAD.
+    return execute(['git', 'symbolic-ref', 'HEAD']).strip()
+
+def rev_parse(revision):
+    """Returns the SHA of the object the given revision points to."""
+    if repository is not None:
+        try:
+            return str(repository.revparse_single(revision).id)
+        except (pygit2.GitError, KeyError, ValueError):
+            pass
+
+    return execute(['git', 'rev-parse', revision]).strip()
+
+def get_merge_base(first, second):
+    """Returns the SHA of the best common ancestor of the two revisions."""
+    if repository is not None:
+        try:
+            merge_base = repository.merge_base(
+                repository.revparse_single(first).peel(pygit2.Commit).id,
+                repository.revparse_single(second).peel(pygit2.Commit).id)
+
+            if merge_base is not None:
+                return str(merge_base)
+        except (pygit2.GitError, KeyError, ValueError):
+            pass
+
+    return execute(['git', 'merge-base', first, second]).strip()
+
 def user_skipped_review_win32():
     """Prints prompt asking whether to skip or post a reveiew, reports result.
 
@@ -98,15 +202,15 @@ def user_skipped_review_win32():
     import msvcrt
     ctrl_d = chr(4)
 
-    print "\nPress 'y' to post, 'n' to skip, or ^D to exit.\n"
+    print("\nPress 'y' to post, 'n' to skip, or ^D to exit.\n")
 
-    choice = msvcrt.getch()
+    choice = msvcrt.getwch()
 
     # Loop until we get a 'y', and 'n', or a Ctrl-D.
     while choice != 'y' and choice != 'n' and choice != ctrl_d:
-        print "Invalid choice. Press 'y' to continue or 'n' to skip or " + \
-            "^D to abort."
-        choice = msvcrt.getch()
+        print("Invalid choice. Press 'y' to continue or 'n' to skip or " +
+              "^D to abort.")
+        choice = msvcrt.getwch()
 
     # Report the user choice.
     if choice == 'y':
@@ -126,7 +230,7 @@ def user_skipped_review_unix():
         `True` if user asked to skip review, `False` otherwise.
     """
     try:
-        raw_input(
+        input(
             "\nPress enter to continue or 'Ctrl-C' to skip.\n")
     except KeyboardInterrupt:
         return True
@@ -153,13 +257,13 @@ else:
 #
 # [1] http://stackoverflow.com/questions/5921556/in-git-bash-on-windows-7-colors-display-as-code-when-running-cucumber-or-rspec
 if os.name == 'nt':
-    creating_review_format = '--pretty=format:%H %d %s'
-    updating_review_format = '--pretty=format:%H %d %s (%cr)'
+    creating_review_format = '%H %d %s'
+    updating_review_format = '%H %d %s (%cr)'
     parent_log_format = '--pretty=format:%H %d %s (%cr)'
     history_log_format = '--pretty=format:%H %d %s (%cr)'
 else:
-    creating_review_format = '--pretty=format:%Cred%H%Creset -%C(yellow)%d%Creset %s'
-    updating_review_format = '--pretty=format:%Cred%H%Creset -%C(yellow)%d%Creset %s %Cgreen(%cr)%Creset'
+    creating_review_format = '%Cred%H%Creset -%C(yellow)%d%Creset %s'
+    updating_review_format = '%Cred%H%Creset -%C(yellow)%d%Creset %s %Cgreen(%cr)%Creset'
     parent_log_format = '--pretty=format:%Cred%H%Creset -%C(yellow)%d%Creset %s %Cgreen(%cr)%Creset'
     history_log_format = '--pretty=format:%Cred%H%Creset -%C(yellow)%d%Creset %s %Cgreen(%cr)%Creset'
 
@@ -169,29 +273,31 @@ else:
 post_review = None
 rbt_version = execute([rbt_executable, '--version'], ignore_errors=True)
 if rbt_version:
-  rbt_version = LooseVersion(rbt_version)
+  rbt_version = parse_version(rbt_version)
   post_review = [rbt_executable, 'post']
 elif execute(['post-review', '--version'], ignore_errors=True):
   post_review = ['post-review']
 else:
-  print 'Please install RBTools before proceeding'
+  print('Please install RBTools before proceeding')
   sys.exit(1)
 
 # Don't do anything if people have unstaged changes.
 diff_stat = execute(['git', 'diff', '--shortstat']).strip()
 
 if diff_stat:
-  print 'Please commit or stash any changes before using post-reviews!'
+  print('Please commit or stash any changes before using post-reviews!')
   sys.exit(1)
 
 # Don't do anything if people have uncommitted changes.
 diff_stat = execute(['git', 'diff', '--shortstat', '--staged']).strip()
 
 if diff_stat:
-  print 'Please commit staged changes before using post-reviews!'
+  print('Please commit staged changes before using post-reviews!')
   sys.exit(1)
 
-top_level_dir = execute(['git', 'rev-parse', '--show-toplevel']).strip()
+repository = open_repository()
+
+top_level_dir = get_top_level_dir()
 
 # Use the tracking_branch specified by the user if exists.
 parser = argparse.ArgumentParser(add_help=False)
@@ -200,27 +306,27 @@ parser.add_argument('--tracking-branch')
 args, _ = parser.parse_known_args()
 
 # Try to read the .reviewboardrc in the top-level directory.
+reviewboardrc = {}
 reviewboardrc_filepath = os.path.join(top_level_dir, '.reviewboardrc')
 if os.path.exists(reviewboardrc_filepath):
-    sys.dont_write_bytecode = True  # Prevent generation of '.reviewboardrcc'.
-    reviewboardrc = imp.load_source('reviewboardrc', reviewboardrc_filepath)
+    reviewboardrc = runpy.run_path(reviewboardrc_filepath)
 
 reviewboard_url = (
     args.server if args.server else
-    reviewboardrc.REVIEWBOARD_URL if 'REVIEWBOARD_URL' in dir(reviewboardrc) else
+    reviewboardrc['REVIEWBOARD_URL'] if 'REVIEWBOARD_URL' in reviewboardrc else
     'https://reviews.apache.org')
 
 tracking_branch = (
     args.tracking_branch if args.tracking_branch else
-    reviewboardrc.TRACKING_BRANCH if 'TRACKING_BRANCH' in dir(reviewboardrc) else
+    reviewboardrc['TRACKING_BRANCH'] if 'TRACKING_BRANCH' in reviewboardrc else
     'master')
 
-branch_ref = execute(['git', 'symbolic-ref', 'HEAD']).strip()
+branch_ref = get_head_ref()
 branch = branch_ref.replace('refs/heads/', '', 1)
 
 # do not work on master branch
 if branch == "master":
-    print "We're expecting you to be working on another branch from master!"
+    print("We're expecting you to be working on another branch from master!")
     sys.exit(1)
 
 temporary_branch = '_post-reviews_' + branch
@@ -231,7 +337,7 @@ atexit.register(lambda: execute(['git', 'branch', '-D', temporary_branch], True)
 # Always put us back on the original branch.
 atexit.register(lambda: execute(['git', 'checkout', branch]))
 
-merge_base = execute(['git', 'merge-base', tracking_branch, branch_ref]).strip()
+merge_base = get_merge_base(tracking_branch, branch_ref)
 
 
 
@@ -240,54 +346,46 @@ output = check_output([
     '--no-pager',
     'log',
     history_log_format,
-    merge_base + '..HEAD'])
-print 'Running \'%s\' across all of ...' % " ".join(post_review)
-print output
-
-log = execute(['git',
-               '--no-pager',
-               'log',
-               '--no-color',
-               '--pretty=oneline',
-               '--reverse',
-               merge_base + '..HEAD']).strip()
-
-if len(log) <= 0:
-    print "No new changes compared with master branch!"
+    merge_base + '..HEAD'],
+    universal_newlines=True)
+print('Running \'%s\' across all of ...' % " ".join(post_review))
+print(output)
+
+commits = read_commits(merge_base + '..HEAD')
+
+if not commits:
+    print("No new changes compared with master branch!")
     sys.exit(1)
 
-shas = []
+# NOTE: Strip the trailing '/' off the URL so we don't generate a
+# pattern that looks for two slashes, e.g., `reviews.apache.org//r/`.
+review_url_regex = re.compile('Review: ({url}/r/[0-9]+)$'.format(
+    url=re.escape(reviewboard_url.strip('/'))))
 
-for line in log.split('\n'):
-    sha = line.split()[0]
-    shas.append(sha)
+# The parts of the post-review/rbt command which are the same for every
+# commit: the arguments passed through from our own command line, and the
+# tracking branch if it was not specified there.
+passthrough_arguments = sys.argv[1:]
 
+tracking_branch_arguments = []
+if args.tracking_branch is None:
+    tracking_branch_arguments = ['--tracking-branch=' + tracking_branch]
 
 previous = tracking_branch
 parent_review_request_id = None
-for i in range(len(shas)):
-    sha = shas[i]
+for i in range(len(commits)):
+    sha, creating_review_output, updating_review_output, message = commits[i]
 
     execute(['git', 'branch', '-D', temporary_branch], True)
 
-    message = execute(['git',
-                       '--no-pager',
-                       'log',
-                       '--pretty=format:%s%n%n%b',
-                       previous + '..' + sha])
-
     review_request_id = None
 
     pos = message.find('Review:')
     if pos != -1:
-        # NOTE: Strip the trailing '/' off the URL so we don't generate a
-        # pattern that looks for two slashes, e.g., `reviews.apache.org//r/`.
-        url_pattern = "/".join([reviewboard_url.strip('/'), 'r', '[0-9]+'])
-        pattern = re.compile('Review: ({url})$'.format(url=url_pattern))
-        match = pattern.search(message.strip().strip('/'))
+        match = review_url_regex.search(message.strip().strip('/'))
 
         if match is None:
-            print "\nInvalid ReviewBoard URL: '{}'".format(message[pos:])
+            print("\nInvalid ReviewBoard URL: '{}'".format(message[pos:]))
             sys.exit(1)
 
         url = match.group(1)
@@ -295,23 +393,11 @@ for i in range(len(shas)):
 
     # Show the commit.
     if review_request_id is None:
-        output = check_output([
-            'git',
-            '--no-pager',
-            'log',
-            creating_review_format,
-            previous + '..' + sha])
-        print '\nCreating diff of:'
-        print output
+        print('\nCreating diff of:')
+        print(creating_review_output)
     else:
-        output = check_output([
-            'git',
-            '--no-pager',
-            'log',
-            updating_review_format,
-            previous + '..' + sha])
-        print '\nUpdating diff of:'
-        print output
+        print('\nUpdating diff of:')
+        print(updating_review_output)
 
     # Show the "parent" commit(s).
     output = check_output([
@@ -319,11 +405,12 @@ for i in range(len(shas)):
         '--no-pager',
         'log',
         parent_log_format,
-        tracking_branch + '..' + previous])
+        tracking_branch + '..' + previous],
+        universal_newlines=True)
 
     if output:
-        print '\n... with parent diff created from:'
-        print output
+        print('\n... with parent diff created from:')
+        print(output)
 
     if user_skipped_review():
         i = i + 1
@@ -334,33 +421,30 @@ for i in range(len(shas)):
     revision_range = previous + ':' + sha
 
     # Build the post-review/rbt command up to the point where they are common.
-    command = post_review
-
-    if args.tracking_branch is None:
-        command = command + ['--tracking-branch=' + tracking_branch]
+    command = post_review + tracking_branch_arguments
 
     if review_request_id:
         command = command + ['--review-request-id=' + review_request_id]
 
     # Determine how to specify the revision range.
-    if rbt_executable in post_review and rbt_version >= LooseVersion('RBTools 0.6'):
+    if rbt_executable in post_review and rbt_version >= (0, 6):
        # rbt >= 0.6.1 supports '--depends-on' argument.
        # Only set the "depends on" if this is not the first review in the chain.
-       if rbt_version >= LooseVersion('RBTools 0.6.1') and parent_review_request_id:
+       if rbt_version >= (0, 6, 1) and parent_review_request_id:
          command = command + ['--depends-on=' + parent_review_request_id]
 
        # rbt >= 0.6 revisions are passed in as args.
-       command = command + sys.argv[1:] + [previous, sha]
+       command = command + passthrough_arguments + [previous, sha]
     else:
         # post-review and rbt < 0.6 revisions are passed in using the revision
         # range option.
         command = command + \
             ['--revision-range=' + revision_range] + \
-            sys.argv[1:]
+            passthrough_arguments
 
     output = execute(command).strip()
 
-    print output
+    print(output)
 
 
     if review_request_id is not None:
@@ -391,28 +475,14 @@ for i in range(len(shas)):
     execute(['git', 'reset', '--hard', sha])
     execute(['git', 'commit', '--amend', '-m', message])
 
-    # Now rebase all remaining shas on top of this amended commit.
-    j = i + 1
-    old_sha = execute(['cat', os.path.join(top_level_dir, '.git/refs/heads', temporary_branch)]).strip()
-    previous = old_sha
-    while j < len(shas):
-        execute(['git', 'checkout', shas[j]])
-        execute(['git', 'rebase', temporary_branch])
-        # Get the sha for our detached HEAD.
-        new_sha = execute(['git', '--no-pager', 'log', '--pretty=format:%H', '-n', '1', 'HEAD']).strip()
-        execute(['git',
-                 'update-ref',
-                 'refs/heads/' + temporary_branch,
-                 new_sha,
-                 old_sha])
-        old_sha = new_sha
-        shas[j] = new_sha
-        j = j + 1
-
-    # Okay, now update the actual branch to our temporary branch.
-    new_sha = old_sha
-    old_sha = execute(['cat', os.path.join(top_level_dir, '.git/refs/heads', branch)]).strip()
-    execute(['git', 'update-ref', 'refs/heads/' + branch, new_sha, old_sha])
+    previous = rev_parse('refs/heads/' + temporary_branch)
+
+    # Now rebase all remaining commits on top of this amended commit. This
+    # also updates the actual branch to point to the rebased commits.
+    execute(['git', 'rebase', '--onto', temporary_branch, sha, branch])
+
+    # Read the remaining commits again, as rebasing changed their shas.
+    commits[i + 1:] = read_commits(temporary_branch + '..' + branch)
 
     i = i + 1
     parent_review_request_id = review_request_id